@@ -9,8 +9,226 @@
 #include <omero/ClientErrors.h>
 #include <omero/IceNoWarnPush.h>
 #include <omero/api/IPixels.h>
+#include <IceUtil/Monitor.h>
+#include <IceUtil/Mutex.h>
+#include <IceUtil/Thread.h>
+#include <IceUtil/UniquePtr.h>
 #include <omero/IceNoWarnPop.h>
 
+#include <map>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+namespace {
+
+    using omero::util::TileData;
+    using omero::util::TileDataPtr;
+    using omero::util::TileLoop;
+    using omero::util::TileLoopIterationPtr;
+
+    struct TileCoords {
+        int z, c, t, x, y, w, h;
+    };
+
+    /**
+     * A single setTile call held back until it can be written in order.
+     */
+    struct PendingTile {
+        Ice::ByteSeq buffer;
+        TileCoords coords;
+    };
+
+    typedef std::vector<PendingTile> PendingTiles;
+
+    /**
+     * State shared between the worker threads and the writing thread.
+     * Tiles are numbered in the order of the serial loop and their
+     * coordinates are worked out from that number when a worker claims
+     * one. Workers may only run ahead of the last written tile by
+     * "window" tiles so that the number of buffered tiles stays bounded.
+     */
+    class TileQueue : public IceUtil::Monitor<IceUtil::Mutex> {
+    private:
+        TileLoop* loop;
+        IceUtil::Mutex readDataMutex;
+        int sizeX, sizeY, sizeZ, sizeC;
+        int tileHeight, tileWidth;
+        size_t tilesX, tilesPerPlane;
+        IceUtil::UniquePtr<Ice::Exception> iceError;
+        IceUtil::UniquePtr<omero::ClientError> clientError;
+        std::string message;
+    public:
+        const size_t tileCount;
+        const size_t window;
+        size_t next;
+        size_t written;
+        std::map<size_t, PendingTiles> done;
+        bool failed;
+
+        TileQueue(TileLoop* loop, int sizeX, int sizeY, int sizeZ, int sizeT, int sizeC,
+                  int tileHeight, int tileWidth, size_t window) :
+            loop(loop), sizeX(sizeX), sizeY(sizeY), sizeZ(sizeZ), sizeC(sizeC),
+            tileHeight(tileHeight), tileWidth(tileWidth),
+            tilesX((sizeX + tileWidth - 1) / tileWidth),
+            tilesPerPlane(tilesX * ((sizeY + tileHeight - 1) / tileHeight)),
+            tileCount(tilesPerPlane * sizeZ * sizeC * sizeT),
+            window(window), next(0), written(0), failed(false) {
+        }
+
+        TileCoords tile(size_t i) const {
+            TileCoords tile;
+            size_t plane = i / tilesPerPlane;
+            size_t offset = i % tilesPerPlane;
+            tile.z = static_cast<int>(plane % sizeZ);
+            tile.c = static_cast<int>((plane / sizeZ) % sizeC);
+            tile.t = static_cast<int>(plane / (sizeZ * sizeC));
+            tile.x = static_cast<int>(offset % tilesX) * tileWidth;
+            tile.y = static_cast<int>(offset / tilesX) * tileHeight;
+            tile.w = tileWidth;
+            if (tile.w + tile.x > sizeX)
+            {
+                tile.w = sizeX - tile.x;
+            }
+            tile.h = tileHeight;
+            if (tile.h + tile.y > sizeY)
+            {
+                tile.h = sizeY - tile.y;
+            }
+            return tile;
+        }
+
+        TileDataPtr createReadData() {
+            IceUtil::Mutex::Lock lock(readDataMutex);
+            return loop->createReadData();
+        }
+
+        /**
+         * Stops all threads, keeping a copy of the exception currently
+         * being handled if it is the first one. Must only be called from
+         * within a catch block.
+         */
+        void failCurrent() {
+            IceUtil::Monitor<IceUtil::Mutex>::Lock lock(*this);
+            if (!failed) {
+                failed = true;
+                try {
+                    throw;
+                } catch (const Ice::Exception& ex) {
+                    iceError.reset(ex.ice_clone());
+                } catch (const omero::ClientError& ex) {
+                    clientError.reset(new omero::ClientError(ex));
+                } catch (const std::exception& ex) {
+                    message = ex.what();
+                } catch (...) {
+                    message = "unknown exception during tile iteration";
+                }
+            }
+            notifyAll();
+        }
+
+        /**
+         * Throws the first exception passed to failCurrent. Ice and
+         * omero::ClientError exceptions keep their type; anything else
+         * is rethrown as a std::runtime_error with the same message.
+         */
+        void rethrow() const {
+            if (iceError.get()) {
+                iceError->ice_throw();
+            }
+            if (clientError.get()) {
+                throw *clientError;
+            }
+            throw std::runtime_error(message);
+        }
+    };
+
+    /**
+     * TileData handed to the iteration on a worker thread. Reads go to
+     * a TileData from TileLoop::createReadData, opened on first use;
+     * writes are kept for the writing thread.
+     */
+    class BufferedTileData : virtual public TileData {
+    private:
+        TileQueue& queue;
+    public:
+        TileDataPtr reader;
+        PendingTiles pending;
+        BufferedTileData(TileQueue& queue) : TileData(), queue(queue) {
+        }
+        virtual ~BufferedTileData() {
+        }
+        virtual Ice::ByteSeq getTile(int z, int c, int t, int x, int y, int w, int h) {
+            if (!reader) {
+                reader = queue.createReadData();
+            }
+            return reader->getTile(z, c, t, x, y, w, h);
+        }
+        virtual void setTile(const Ice::ByteSeq& buffer, int z, int c, int t, int x, int y, int w, int h) {
+            PendingTile tile;
+            tile.buffer = buffer;
+            tile.coords.z = z;
+            tile.coords.c = c;
+            tile.coords.t = t;
+            tile.coords.x = x;
+            tile.coords.y = y;
+            tile.coords.w = w;
+            tile.coords.h = h;
+            pending.push_back(tile);
+        }
+        virtual void close() {
+            // The reader is closed by forEachTile once all workers are done.
+        }
+    };
+
+    typedef IceUtil::Handle<BufferedTileData> BufferedTileDataPtr;
+
+    class TileWorker : public IceUtil::Thread {
+    private:
+        TileQueue& queue;
+        TileLoopIterationPtr iteration;
+    public:
+        BufferedTileDataPtr data;
+
+        TileWorker(TileQueue& queue, const TileLoopIterationPtr& iteration) :
+            queue(queue), iteration(iteration), data(new BufferedTileData(queue)) {
+        }
+
+        virtual void run() {
+            while (true) {
+                size_t i;
+                {
+                    IceUtil::Monitor<IceUtil::Mutex>::Lock lock(queue);
+                    while (!queue.failed && queue.next < queue.tileCount
+                           && queue.next >= queue.written + queue.window) {
+                        queue.wait();
+                    }
+                    if (queue.failed || queue.next >= queue.tileCount) {
+                        return;
+                    }
+                    i = queue.next++;
+                }
+
+                TileCoords tile = queue.tile(i);
+                try {
+                    iteration->run(data, tile.z, tile.c, tile.t, tile.x, tile.y,
+                                   tile.w, tile.h, static_cast<int>(i));
+                } catch (...) {
+                    queue.failCurrent();
+                    return;
+                }
+
+                IceUtil::Monitor<IceUtil::Mutex>::Lock lock(queue);
+                queue.done[i].swap(data->pending);
+                queue.notifyAll();
+            }
+        }
+    };
+
+    typedef IceUtil::Handle<TileWorker> TileWorkerPtr;
+
+}
+
 namespace omero {
     namespace util {
 
@@ -44,6 +262,10 @@ namespace omero {
         TileLoop::~TileLoop() {
         }
 
+        TileDataPtr TileLoop::createReadData() {
+            return createData();
+        }
+
         int TileLoop::forEachTile(int sizeX, int sizeY, int sizeZ, int sizeT, int sizeC,
                                   int tileHeight, int tileWidth, const TileLoopIterationPtr& iteration) {
 
@@ -87,12 +309,91 @@ namespace omero {
             return tileCount;
         }
 
+        int TileLoop::forEachTile(int sizeX, int sizeY, int sizeZ, int sizeT, int sizeC,
+                                  int tileHeight, int tileWidth, const TileLoopIterationPtr& iteration,
+                                  int threadCount) {
+
+            if (threadCount <= 1) {
+                return forEachTile(sizeX, sizeY, sizeZ, sizeT, sizeC, tileHeight, tileWidth, iteration);
+            }
+
+            TileDataPtr data = createData();
+            TileQueue queue(this, sizeX, sizeY, sizeZ, sizeT, sizeC, tileHeight, tileWidth,
+                            2 * threadCount);
+
+            std::vector<TileWorkerPtr> workers;
+            std::vector<IceUtil::ThreadControl> controls;
+            try {
+                for (int i = 0; i < threadCount; i++) {
+                    TileWorkerPtr worker = new TileWorker(queue, iteration);
+                    workers.push_back(worker);
+                    controls.push_back(worker->start());
+                }
+            } catch (...) {
+                queue.failCurrent();
+            }
+
+            // Write tiles in order while the workers compute the next ones.
+            while (true) {
+                PendingTiles ready;
+                {
+                    IceUtil::Monitor<IceUtil::Mutex>::Lock lock(queue);
+                    if (queue.written >= queue.tileCount) {
+                        break;
+                    }
+                    while (!queue.failed && queue.done.find(queue.written) == queue.done.end()) {
+                        queue.wait();
+                    }
+                    if (queue.failed) {
+                        break;
+                    }
+                    ready.swap(queue.done[queue.written]);
+                    queue.done.erase(queue.written);
+                }
+
+                try {
+                    for (PendingTiles::const_iterator it = ready.begin(); it != ready.end(); ++it) {
+                        const TileCoords& tile = it->coords;
+                        data->setTile(it->buffer, tile.z, tile.c, tile.t, tile.x, tile.y, tile.w, tile.h);
+                    }
+                } catch (...) {
+                    queue.failCurrent();
+                    break;
+                }
+
+                IceUtil::Monitor<IceUtil::Mutex>::Lock lock(queue);
+                queue.written++;
+                queue.notifyAll();
+            }
+
+            for (size_t i = 0; i < controls.size(); i++) {
+                controls[i].join();
+            }
+
+            // Close the workers' read-only data whether or not the loop failed.
+            for (size_t i = 0; i < workers.size(); i++) {
+                if (workers[i]->data->reader) {
+                    try {
+                        workers[i]->data->reader->close();
+                    } catch (...) {
+                        queue.failCurrent();
+                    }
+                }
+            }
+
+            if (queue.failed) {
+                queue.rethrow();
+            }
+            return static_cast<int>(queue.tileCount);
+        }
+
         //
         // RPSTileData
         //
 
         RPSTileData::RPSTileData(const RPSTileLoopPtr& loop,
-                                 const omero::api::RawPixelsStorePrx& rps) : TileData(), loop(loop), rps(rps) {
+                                 const omero::api::RawPixelsStorePrx& rps,
+                                 bool readOnly) : TileData(), loop(loop), rps(rps), readOnly(readOnly) {
         }
 
         RPSTileData::~RPSTileData() {
@@ -107,6 +408,10 @@ namespace omero {
         }
 
         void RPSTileData::close() {
+            if (readOnly) {
+                rps->close();
+                return;
+            }
             omero::model::PixelsPtr pixels = rps->save();
             loop->setPixels(pixels);
             rps->close(); // TODO: this should be a wrapper which calls close
@@ -142,11 +447,22 @@ namespace omero {
             return new RPSTileData(this, rps);
         }
 
+        TileDataPtr RPSTileLoop::createReadData() {
+            omero::api::RawPixelsStorePrx rps = getSession()->createRawPixelsStore();
+            rps->setPixelsId(getPixels()->getId()->getValue(), false); // 'false' is ignored here.
+            return new RPSTileData(this, rps, true);
+        }
+
         omero::api::ServiceFactoryPrx RPSTileLoop::getSession() {
             return session;
         }
 
         int RPSTileLoop::forEachTile(int tileHeight, int tileWidth, const TileLoopIterationPtr& iteration) {
+            return forEachTile(tileHeight, tileWidth, iteration, 1);
+        }
+
+        int RPSTileLoop::forEachTile(int tileHeight, int tileWidth, const TileLoopIterationPtr& iteration,
+                                     int threadCount) {
 
             if (!pixels->isLoaded()) {
                 pixels = getSession()->getPixelsService()->retrievePixDescription(pixels->getId()->getValue());
@@ -158,7 +474,8 @@ namespace omero {
             int sizeC = pixels->getSizeC()->getValue();
             int sizeT = pixels->getSizeT()->getValue();
 
-            return TileLoop::forEachTile(sizeX, sizeY, sizeZ, sizeT, sizeC, tileWidth, tileHeight, iteration);
+            return TileLoop::forEachTile(sizeX, sizeY, sizeZ, sizeT, sizeC, tileWidth, tileHeight, iteration,
+                                         threadCount);
         }
 
     }
@@ -92,19 +92,47 @@ namespace omero {
             TileLoop();
             virtual ~TileLoop() = 0;
             virtual TileDataPtr createData() = 0;
+
+            /**
+             * Returns a TileData which is only used for getTile calls by the
+             * worker threads of the multi-threaded forEachTile, and which is
+             * closed once those threads have finished. Calls are serialized.
+             * The default returns createData().
+             */
+            virtual TileDataPtr createReadData();
+
             virtual int forEachTile(int sizeX, int sizeY, int sizeZ, int sizeT, int sizeC,
                                    int tileHeight, int tileWidth, const TileLoopIterationPtr& iteration);
+
+            /**
+             * Runs the iteration on threadCount worker threads. The first
+             * getTile call on a worker obtains that worker's own TileData
+             * from createReadData(). setTile calls are buffered and written
+             * by the calling thread through a single TileData from
+             * createData(), in the same order as the serial loop, while the
+             * workers carry on with the following tiles. The iteration's run
+             * method must therefore be thread-safe. A thread count of one or
+             * less runs the serial loop.
+             */
+            virtual int forEachTile(int sizeX, int sizeY, int sizeZ, int sizeT, int sizeC,
+                                   int tileHeight, int tileWidth, const TileLoopIterationPtr& iteration,
+                                   int threadCount);
         };
 
         // Forward defs
         typedef IceUtil::Handle<RPSTileLoop> RPSTileLoopPtr;
 
+        /**
+         * A read-only RPSTileData is closed without saving the pixels.
+         */
         class OMERO_CLIENT RPSTileData : virtual public TileData {
         protected:
             RPSTileLoopPtr loop;
             omero::api::RawPixelsStorePrx rps;
+            bool readOnly;
         public:
-            RPSTileData(const RPSTileLoopPtr& loop, const omero::api::RawPixelsStorePrx& rps);
+            RPSTileData(const RPSTileLoopPtr& loop, const omero::api::RawPixelsStorePrx& rps,
+                        bool readOnly = false);
             virtual ~RPSTileData();
             virtual Ice::ByteSeq getTile(int z, int c, int t, int x, int y, int w, int h);
             virtual void setTile(const Ice::ByteSeq& buffer, int z, int c, int t, int x, int y, int w, int h);
@@ -123,7 +151,21 @@ namespace omero {
             virtual omero::model::PixelsPtr getPixels();
             virtual void setPixels(const omero::model::PixelsPtr& pixels);
             virtual int forEachTile(int tileHeight, int tileWidth, const TileLoopIterationPtr& iteration);
+
+            /**
+             * Multi-threaded variant of forEachTile. Each worker thread which
+             * reads tiles opens its own RawPixelsStore through
+             * createReadData(); those stores are read-only, are never saved
+             * and are closed once the workers finish, whether or not the loop
+             * succeeded. All setTile calls go, in serial order, through the
+             * single RawPixelsStore from createData(), which is the only one
+             * that saves and updates the pixels on close. The iteration's run
+             * method must be thread-safe.
+             */
+            virtual int forEachTile(int tileHeight, int tileWidth, const TileLoopIterationPtr& iteration,
+                                    int threadCount);
             virtual TileDataPtr createData();
+            virtual TileDataPtr createReadData();
         };
 
 
@@ -30,6 +30,42 @@ public:
     }
 };
 
+/**
+ * Fills each tile of an int8 image with its tile number.
+ */
+class PatternIteration : virtual public TileLoopIteration {
+private:
+    // Preventing copy-construction and assigning by value.
+    PatternIteration& operator=(const PatternIteration& rv);
+    PatternIteration(PatternIteration&);
+public:
+    PatternIteration() : TileLoopIteration(){}
+    ~PatternIteration(){}
+    void run(const TileDataPtr& data, int z, int c, int t, int x, int y, int tileWidth, int tileHeight, int tileCount) const {
+        Ice::ByteSeq buf(tileWidth*tileHeight, static_cast<Ice::Byte>(tileCount));
+        data->setTile(buf, z, c, t, x, y, tileWidth, tileHeight);
+    }
+};
+
+/**
+ * Checks that each tile holds what PatternIteration wrote.
+ */
+class CheckPatternIteration : virtual public TileLoopIteration {
+private:
+    // Preventing copy-construction and assigning by value.
+    CheckPatternIteration& operator=(const CheckPatternIteration& rv);
+    CheckPatternIteration(CheckPatternIteration&);
+public:
+    CheckPatternIteration() : TileLoopIteration(){}
+    ~CheckPatternIteration(){}
+    void run(const TileDataPtr& data, int z, int c, int t, int x, int y, int tileWidth, int tileHeight, int tileCount) const {
+        Ice::ByteSeq buf = data->getTile(z, c, t, x, y, tileWidth, tileHeight);
+        if (buf != Ice::ByteSeq(tileWidth*tileHeight, static_cast<Ice::Byte>(tileCount))) {
+            throw omero::ClientError(__FILE__, __LINE__, "unexpected tile data");
+        }
+    }
+};
+
 
 class RndFixture {
     Fixture f;
@@ -102,6 +138,30 @@ public:
 
     }
 
+    /**
+     * Create an image of several tiles per plane, write its binary data
+     * and read it back using threadCount worker threads for each loop.
+     */
+    ImagePtr createTiledImage(int threadCount) {
+        PixelsPtr pixels = f.pixels();
+        pixels->setSizeX(rint(600));
+        pixels->setSizeY(rint(600));
+        ImagePtr image = new ImageI();
+        image->setName(rstring("createTiledImage"));
+        image->addPixels(pixels);
+        image = ImagePtr::dynamicCast(update()->saveAndReturnObject(image));
+
+        RPSTileLoopPtr loop = new RPSTileLoop(f.client->getSession(), image->getPixels(0));
+        int count = loop->forEachTile(256, 256, new PatternIteration(), threadCount);
+        if (count != 9) {
+            throw omero::ClientError(__FILE__, __LINE__, "unexpected tile count");
+        }
+        loop->forEachTile(256, 256, new CheckPatternIteration(), threadCount);
+
+        image->setPixels(0, loop->getPixels());
+        return image;
+    }
+
 };
 
 TEST(RenderingSettingsTest, testResetDefaultsInImage )
@@ -112,3 +172,12 @@ TEST(RenderingSettingsTest, testResetDefaultsInImage )
     ASSERT_TRUE( img->getId() );
     f.rndService()->resetDefaultsInImage(img->getId()->getValue());
 }
+
+TEST(RenderingSettingsTest, testResetDefaultsInImageWithParallelTiles )
+{
+
+    RndFixture f;
+    ImagePtr img = f.createTiledImage(4);
+    ASSERT_TRUE( img->getId() );
+    f.rndService()->resetDefaultsInImage(img->getId()->getValue());
+}
@@ -0,0 +1,195 @@
+/*
+ * Copyright (C) 2026 University of Dundee & Open Microscopy Environment.
+ * All rights reserved.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License along
+ * with this program; if not, write to the Free Software Foundation, Inc.,
+ * 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+ */
+
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+#include <omero/IceNoWarnPush.h>
+#include <IceUtil/Mutex.h>
+#include <omero/IceNoWarnPop.h>
+
+#include <omero/util/tiles.h>
+#include <omero/fixture.h>
+
+using namespace omero::util;
+using namespace std;
+
+/*
+ * In-memory TileLoop which records every setTile call, in order,
+ * made against any of the TileData instances it creates, as well as
+ * how many of them were created and closed.
+ */
+class RecordingTileLoop : virtual public TileLoop {
+public:
+    IceUtil::Mutex mutex;
+    vector<vector<int> > writes;
+    int created;
+    int readers;
+    int closed;
+
+    RecordingTileLoop() : TileLoop(), created(0), readers(0), closed(0) {}
+    ~RecordingTileLoop() {}
+    TileDataPtr createData();
+    TileDataPtr createReadData();
+};
+
+typedef IceUtil::Handle<RecordingTileLoop> RecordingTileLoopPtr;
+
+class RecordingTileData : virtual public TileData {
+private:
+    RecordingTileLoop* loop;
+public:
+    RecordingTileData(RecordingTileLoop* loop) : TileData(), loop(loop) {}
+    ~RecordingTileData() {}
+    Ice::ByteSeq getTile(int z, int /*c*/, int /*t*/, int /*x*/, int /*y*/, int w, int h) {
+        return Ice::ByteSeq(w * h, static_cast<Ice::Byte>(z));
+    }
+    void setTile(const Ice::ByteSeq& buffer, int z, int c, int t, int x, int y, int w, int h) {
+        int values[] = {z, c, t, x, y, w, h, static_cast<int>(buffer.size()), buffer[0]};
+        IceUtil::Mutex::Lock lock(loop->mutex);
+        loop->writes.push_back(vector<int>(values, values + 9));
+    }
+    void close() {
+        IceUtil::Mutex::Lock lock(loop->mutex);
+        loop->closed++;
+    }
+};
+
+TileDataPtr RecordingTileLoop::createData() {
+    IceUtil::Mutex::Lock lock(mutex);
+    created++;
+    return new RecordingTileData(this);
+}
+
+TileDataPtr RecordingTileLoop::createReadData() {
+    IceUtil::Mutex::Lock lock(mutex);
+    readers++;
+    return new RecordingTileData(this);
+}
+
+class FillIteration : virtual public TileLoopIteration {
+public:
+    FillIteration() : TileLoopIteration() {}
+    ~FillIteration() {}
+    void run(const TileDataPtr& data, int z, int c, int t, int x, int y,
+             int tileWidth, int tileHeight, int tileCount) const {
+        Ice::ByteSeq buf = data->getTile(z, c, t, x, y, tileWidth, tileHeight);
+        buf[0] = static_cast<Ice::Byte>(buf[0] + tileCount);
+        data->setTile(buf, z, c, t, x, y, tileWidth, tileHeight);
+    }
+};
+
+class WriteIteration : virtual public TileLoopIteration {
+public:
+    WriteIteration() : TileLoopIteration() {}
+    ~WriteIteration() {}
+    void run(const TileDataPtr& data, int z, int c, int t, int x, int y,
+             int tileWidth, int tileHeight, int tileCount) const {
+        Ice::ByteSeq buf(tileWidth * tileHeight, static_cast<Ice::Byte>(tileCount));
+        data->setTile(buf, z, c, t, x, y, tileWidth, tileHeight);
+    }
+};
+
+class FailingIteration : virtual public TileLoopIteration {
+private:
+    bool clientError;
+public:
+    FailingIteration(bool clientError) : TileLoopIteration(), clientError(clientError) {}
+    ~FailingIteration() {}
+    void run(const TileDataPtr& data, int z, int c, int t, int x, int y,
+             int tileWidth, int tileHeight, int tileCount) const {
+        data->getTile(z, c, t, x, y, tileWidth, tileHeight);
+        if (tileCount == 5) {
+            if (clientError) {
+                throw omero::ClientError(__FILE__, __LINE__, "failing tile");
+            }
+            throw std::logic_error("bad tile");
+        }
+    }
+};
+
+TEST(TilesTest, testParallelWritesInSerialOrder )
+{
+    RecordingTileLoopPtr serial = new RecordingTileLoop();
+    int serialCount = serial->forEachTile(100, 70, 2, 2, 3, 32, 32, new FillIteration());
+
+    RecordingTileLoopPtr parallel = new RecordingTileLoop();
+    int parallelCount = parallel->forEachTile(100, 70, 2, 2, 3, 32, 32, new FillIteration(), 4);
+
+    ASSERT_EQ(144, serialCount);
+    ASSERT_EQ(serialCount, parallelCount);
+    ASSERT_EQ(1, serial->created);
+    ASSERT_EQ(1, parallel->created);
+    ASSERT_EQ(serial->writes, parallel->writes);
+}
+
+TEST(TilesTest, testParallelClosesReadData )
+{
+    RecordingTileLoopPtr loop = new RecordingTileLoop();
+    loop->forEachTile(100, 70, 2, 1, 3, 32, 32, new FillIteration(), 4);
+    ASSERT_LE(1, loop->readers);
+    ASSERT_GE(4, loop->readers);
+    // Only the read data is closed; the write data is left as in the serial loop.
+    ASSERT_EQ(loop->readers, loop->closed);
+}
+
+TEST(TilesTest, testWriteOnlyIterationOpensNoReadData )
+{
+    RecordingTileLoopPtr loop = new RecordingTileLoop();
+    int count = loop->forEachTile(100, 70, 1, 1, 1, 32, 32, new WriteIteration(), 4);
+    ASSERT_EQ(12, count);
+    ASSERT_EQ(12u, loop->writes.size());
+    ASSERT_EQ(1, loop->created);
+    ASSERT_EQ(0, loop->readers);
+    ASSERT_EQ(0, loop->closed);
+}
+
+TEST(TilesTest, testSingleThreadIsSerial )
+{
+    RecordingTileLoopPtr loop = new RecordingTileLoop();
+    int count = loop->forEachTile(10, 10, 1, 1, 1, 4, 4, new FillIteration(), 1);
+    ASSERT_EQ(9, count);
+    ASSERT_EQ(1, loop->created);
+    ASSERT_EQ(0, loop->readers);
+}
+
+TEST(TilesTest, testWorkerClientErrorIsRethrown )
+{
+    RecordingTileLoopPtr loop = new RecordingTileLoop();
+    try {
+        loop->forEachTile(100, 100, 1, 1, 1, 10, 10, new FailingIteration(true), 4);
+        FAIL() << "expected omero::ClientError";
+    } catch (const omero::ClientError& ex) {
+        ASSERT_EQ(string("failing tile"), string(ex.what()));
+    }
+    ASSERT_EQ(loop->readers, loop->closed);
+}
+
+TEST(TilesTest, testWorkerStdExceptionMessageIsKept )
+{
+    RecordingTileLoopPtr loop = new RecordingTileLoop();
+    try {
+        loop->forEachTile(100, 100, 1, 1, 1, 10, 10, new FailingIteration(false), 4);
+        FAIL() << "expected std::runtime_error";
+    } catch (const std::runtime_error& ex) {
+        ASSERT_EQ(string("bad tile"), string(ex.what()));
+    }
+    ASSERT_EQ(loop->readers, loop->closed);
+}
@@ -11,6 +11,7 @@
 FOR TRAINING PURPOSES ONLY!
 """
 
+import numpy
 from omero.gateway import BlitzGateway
 from Parse_OMERO_Properties import USERNAME, PASSWORD, HOST, PORT
 from Parse_OMERO_Properties import imageId
@@ -68,16 +69,26 @@ for i, p in enumerate(planes):
 
 # Retrieve a given hypercube
 # ==========================
+# getPlanes() yields the planes in the order of zct_list, so each one can
+# be copied into a single (Z, C, T, Y, X) numpy array as it arrives. The
+# array is created from the first plane, which gives its shape and dtype.
 zct_list = []
 # get the top half of the Z-stack
-for z in range(size_z // 2, size_z):
+z_start = size_z // 2
+for z in range(z_start, size_z):
     for c in range(size_c):          # all channels
         for t in range(size_t):      # all time-points
             zct_list.append((z, c, t))
 print("\nHyper stack of planes:")
 planes = pixels.getPlanes(zct_list)
-for i, p in enumerate(planes):
-    print("plane zct:", zct_list[i], " min:", p.min(), " max:", p.max())
+hypercube = None
+for (z, c, t), p in zip(zct_list, planes):
+    print("plane zct:", (z, c, t), " min:", p.min(), " max:", p.max())
+    if hypercube is None:
+        shape = (size_z - z_start, size_c, size_t) + p.shape
+        hypercube = numpy.zeros(shape, dtype=p.dtype)
+    hypercube[z - z_start, c, t] = p
+print("Hypercube shape (z, c, t, y, x):", hypercube.shape)
 
 # Retrieve a histogram
 # ====================
@@ -148,6 +148,27 @@ for col in data.columns:
     print("Query Results for Column: ", col.name)
     for v in col.values:
         print("   ", v)
+
+
+# Read a large table in chunks
+# ============================
+# Reading every row in one call builds the whole table in memory and can
+# exceed the Ice message size limit. Read a fixed number of rows at a time
+# instead, so that only one chunk is held in memory. Pick chunk_size from
+# the width of a row: tables with many or long string columns need smaller
+# chunks to keep each response under the limit.
+def read_in_chunks(tbl, col_numbers, chunk_size=1000):
+    row_count = tbl.getNumberOfRows()
+    for start in range(0, row_count, chunk_size):
+        stop = min(start + chunk_size, row_count)
+        yield tbl.read(col_numbers, start, stop)
+
+
+col_numbers = list(range(len(open_table.getHeaders())))
+for chunk in read_in_chunks(open_table, col_numbers, chunk_size=4):
+    print("\nChunk of rows:", chunk.rowNumbers)
+    for col in chunk.columns:
+        print("   ", col.name, col.values)
 open_table.close()           # we're done
 
 